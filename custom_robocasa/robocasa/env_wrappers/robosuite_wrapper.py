@@ -28,6 +28,18 @@ class RobosuiteWrapper(gym.Wrapper):
 
         return obs_dict
 
+    def reset_to_batch(self, states):
+        """
+        Restores each flattened simulator state in @states in order and yields the processed
+        observation for it. The simulator stays at the yielded state until the next item is
+        requested, so rewards and success can be queried in between.
+        """
+        reset_to = self.env.reset_to
+        state = dict()
+        for s in states:
+            state["states"] = s
+            yield self.process_observation(reset_to(state))
+
     def process_observation(self, obs_dict):
         for key in obs_dict:
             if "image" in key or "segmentation" in key:
@@ -121,6 +121,15 @@ class SegmentationWrapper(gym.Wrapper):
 
         return obs_dict
 
+    def reset_to_batch(self, states):
+        for obs_dict in self.env.reset_to_batch(states):
+            segmentation_masks = self.get_segmentation_mask(obs_dict)
+
+            for cam, mask in segmentation_masks.items():
+                obs_dict[f"{cam}_segmentation_mask"] = mask
+
+            yield obs_dict
+
     def get_segmentation_mask(self, obs_dict):
         masks = {}
         class_to_geom_ids = self.get_class_to_geom_ids()
@@ -403,7 +403,7 @@ class Fixture(MujocoXMLObject):
 
     def get_bbox_points(self, trans=None, rot=None):
         """
-        Get the full set of bounding box points of the object
+        Get the full set of bounding box points of the object, as an (N, 3) array
         rot: a rotation matrix
         """
         bbox_offsets = self.get_ext_sites(all_points=True, relative=True)
@@ -416,8 +416,8 @@ class Fixture(MujocoXMLObject):
             rot = np.array([0, 0, self.rot])
             rot = T.euler2mat(rot)
 
-        points = [(np.matmul(rot, p) + trans) for p in bbox_offsets]
-        return points
+        # rotate all points with a single matmul, one point per row
+        return np.asarray(bbox_offsets) @ rot.T + trans
 
     def _remove_element(self, elem):
         # # This method not currently working
@@ -5,16 +5,23 @@ Adapted from robomimic's dataset_states_to_obs.py script.
 
 import os
 import json
+import math
+import queue
 from typing import OrderedDict
 import h5py
+import hdf5plugin
+import imageio
 import argparse
 import numpy as np
-from copy import deepcopy
 import multiprocessing
-import queue
+from multiprocessing import resource_tracker, shared_memory
+from collections import namedtuple
+import shutil
+import threading
 import time
 import traceback
-from persistqueue import Queue as PersistQueue
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from persistqueue import SQLiteQueue as SQLitePersistQueue
 
 from robocasa.utils.env_utils import create_env
@@ -24,12 +31,7 @@ from tqdm import tqdm
 
 from robocasa.env_wrappers.robosuite_wrapper import RobosuiteWrapper
 from robocasa.env_wrappers.segmentation_wrapper import SegmentationWrapper
-from robocasa.utils.transform_utils import (
-    axisangle2quat_numpy,
-    mat2quat_numpy,
-    quat2axisangle_numpy,
-    quat2mat_numpy,
-)
+from robosuite.utils.numba import jit_decorator
 
 # from robomimic.utils.log_utils import log_warning
 
@@ -69,61 +71,69 @@ def extract_trajectory(
     if args.global_actions:
         base_rot = env.sim.data.get_site_xmat(f"mobilebase{env.robots[0].idn}_center")
 
-        global_actions = actions.copy()
-
-        global_actions[:, :3] = np.einsum("ij, nj -> ni", base_rot, actions[:, :3])
-
-        rot_mats = quat2mat_numpy(axisangle2quat_numpy(actions[:, 3:6]))
-        global_rot_mats = np.einsum(
-            "ij, njk, kl -> nil", base_rot, rot_mats, base_rot.T
+        global_actions = np.empty_like(actions)
+        _global_actions(
+            np.ascontiguousarray(base_rot, dtype=actions.dtype), actions, global_actions
         )
-        global_actions[:, 3:6] = quat2axisangle_numpy(mat2quat_numpy(global_rot_mats))
 
     traj = dict(
-        obs=[],
+        obs=OrderedDict(),
         next_obs=[],
         rewards=[],
         dones=[],
-        actions=np.array(actions),
+        actions=actions,
         # actions_abs=[],
-        states=np.array(states),
+        states=states,
         initial_state_dict=initial_state,
         datagen_info=[],
     )
     if args.global_actions:
-        traj["global_actions"] = np.array(global_actions)
+        traj["global_actions"] = global_actions
 
     max_segmented_pc_size = 0
 
     traj_len = 20 #states.shape[0]
     # iteration variable @t is over "next obs" indices
-    for t in tqdm(range(traj_len)):
-        obs = deepcopy(env.reset_to({"states": states[t]}))
-
-        obs_keys_to_remove = []
-        for obs_key in obs:
-            if args.dont_store_image and "image" in obs_key:
-                obs_keys_to_remove.append(obs_key)
-            
-            if args.dont_store_depth and "depth" in obs_key:
-                obs_keys_to_remove.append(obs_key)
-
-            # if args.segmentation and "mask" in obs_key:
-            #     obs_keys_to_remove.append(obs_key)
+    obs_states = states[:traj_len]
+    obs_source_dtypes = dict()
+    # bind env methods once instead of resolving them through the wrapper chain every step
+    reward_fn = env.reward
+    check_success_fn = env._check_success
+    if add_datagen_info:
+        get_datagen_info_fn = env.base_env.get_datagen_info
+    obs_iter = env.reset_to_batch(obs_states)
+    for t, obs in enumerate(tqdm(obs_iter, total=len(obs_states))):
+        if t == 0:
+            # the observation keys don't change along a trajectory, so pick the ones to keep
+            # once and allocate arrays for the whole trajectory from the first observation
+            obs_keys_to_remove = frozenset(
+                obs_key
+                for obs_key in obs
+                if (args.dont_store_image and "image" in obs_key)
+                or (args.dont_store_depth and "depth" in obs_key)
+                # or (args.segmentation and "mask" in obs_key)
+            )
+            traj["obs"] = _allocate_obs_buffers(
+                {k: v for k, v in obs.items() if k not in obs_keys_to_remove},
+                len(obs_states),
+                args,
+                obs_source_dtypes,
+                prefix="obs/",
+            )
 
-        for obs_key in obs_keys_to_remove:
-            del obs[obs_key]
+        # copies this step's observations straight into the trajectory arrays
+        _store_obs(traj["obs"], obs, t)
 
         # extract datagen info
         if add_datagen_info:
-            datagen_info = env.base_env.get_datagen_info(action=actions[t])
+            datagen_info = get_datagen_info_fn(action=actions[t])
         else:
             datagen_info = {}
 
         # infer reward signal
         # note: our tasks use reward r(s'), reward AFTER transition, so this is
         #       the reward for the current timestep
-        r = env.reward()
+        r = reward_fn()
 
         # infer done signal
         done = False
@@ -132,21 +142,19 @@ def extract_trajectory(
             done = done or (t == traj_len)
         if (done_mode == 0) or (done_mode == 2):
             # done = 1 when s' is task success state
-            done = done or env._check_success()
+            done = done or check_success_fn()
         done = int(done)
 
         # get the absolute action
         # action_abs = env.base_env.convert_rel_to_abs_action(actions[t])
 
         # collect transition
-        traj["obs"].append(obs)
         traj["rewards"].append(r)
         traj["dones"].append(done)
         traj["datagen_info"].append(datagen_info)
         # traj["actions_abs"].append(action_abs)
 
-    # convert list of dict to dict of list for obs dictionaries (for convenient writes to hdf5 dataset)
-    traj["obs"] = TensorUtils.list_of_flat_dict_to_dict_of_list(traj["obs"])
+    # convert list of dict to dict of list for datagen info (for convenient writes to hdf5 dataset)
     traj["datagen_info"] = TensorUtils.list_of_flat_dict_to_dict_of_list(
         traj["datagen_info"]
     )
@@ -155,6 +163,9 @@ def extract_trajectory(
     for k in traj:
         # if k == "initial_state_dict":
         #     continue
+        if k == "obs":
+            # already stored as arrays
+            continue
         if isinstance(traj[k], dict):
             for kp in traj[k]:
                 if isinstance(traj[k][kp][0], dict):
@@ -162,133 +173,716 @@ def extract_trajectory(
                         traj[k][kp]
                     )
                     for kpp in traj[k][kp]:
-                        traj[k][kp][kpp] = np.array(traj[k][kp][kpp])
+                        traj[k][kp][kpp] = _stack_list(traj[k][kp][kpp])
                 else:
-                    traj[k][kp] = np.array(traj[k][kp])
+                    traj[k][kp] = _stack_list(traj[k][kp])
+        elif isinstance(traj[k], list):
+            traj[k] = _stack_list(traj[k])
         else:
-            traj[k] = np.array(traj[k])
+            # actions and states are already arrays, don't copy them again
+            traj[k] = np.asarray(traj[k])
+
+    # the writer only needs dataset paths and arrays, so resolve the nesting once here
+    traj["obs_flat"] = _flatten_obs(traj.pop("obs"))
+    # original dtypes of observations that were stored at lower precision, so that loaders
+    # can upcast them again
+    traj["obs_source_dtypes"] = obs_source_dtypes
 
     return traj
 
 
+def _stack_list(lst):
+    """
+    Stacks the per-step arrays in @lst into one preallocated array and empties @lst, so
+    that the per-step arrays can be freed while the trajectory is still being assembled
+    instead of doubling its memory until it is returned. Lists of scalars go through
+    np.array.
+    """
+    if len(lst) == 0 or not isinstance(lst[0], np.ndarray):
+        return np.array(lst)
+    out = np.empty((len(lst),) + lst[0].shape, dtype=lst[0].dtype)
+    np.stack(lst, axis=0, out=out)
+    lst.clear()
+    return out
+
+
+@jit_decorator
+def _global_actions(base_rot, actions, out):
+    """
+    Rotates the position (0:3) and axis-angle rotation (3:6) deltas of @actions from the
+    mobile base frame to the world frame given by @base_rot, in a single pass over the rows.
+    Remaining action dimensions are copied unchanged.
+
+    Conjugating a rotation by the base rotation B rotates its axis, i.e. B R B^T has axis B w
+    and the same angle as R, so both parts reduce to one 3x3 matvec per row. The resulting
+    axis-angle is canonicalized to an angle in [0, pi], like the axis-angle -> quat -> matrix
+    -> quat -> axis-angle round trip this replaces.
+
+    Args:
+        base_rot (np.array): (3, 3) rotation matrix of the mobile base
+        actions (np.array): (N, D) array of actions with D >= 6
+        out (np.array): (N, D) array to write the global actions to
+    """
+    n, d = actions.shape
+    for i in range(n):
+        for j in range(6, d):
+            out[i, j] = actions[i, j]
+        for r in range(3):
+            out[i, r] = (
+                base_rot[r, 0] * actions[i, 0]
+                + base_rot[r, 1] * actions[i, 1]
+                + base_rot[r, 2] * actions[i, 2]
+            )
+            out[i, 3 + r] = (
+                base_rot[r, 0] * actions[i, 3]
+                + base_rot[r, 1] * actions[i, 4]
+                + base_rot[r, 2] * actions[i, 5]
+            )
+
+        angle = math.sqrt(out[i, 3] ** 2 + out[i, 4] ** 2 + out[i, 5] ** 2)
+        half_cos = math.cos(angle / 2.0)
+        half_sin = math.sin(angle / 2.0)
+        if abs(half_sin) <= 1e-8:
+            # zero rotation (up to full turns)
+            out[i, 3] = 0.0
+            out[i, 4] = 0.0
+            out[i, 5] = 0.0
+            continue
+
+        # fold the angle into [0, pi], flipping the axis when needed
+        scale = 2.0 * math.acos(min(abs(half_cos), 1.0)) / angle
+        if half_cos * half_sin < 0.0:
+            scale = -scale
+        out[i, 3] *= scale
+        out[i, 4] *= scale
+        out[i, 5] *= scale
+
+
+def _storage_dtype(key, dtype, args):
+    """
+    Returns the dtype observation @key of dtype @dtype is stored with. Depth maps are stored at
+    --depth_dtype precision, other float observations at --obs_dtype precision. Images must
+    already be uint8.
+    """
+    if "image" in key:
+        assert dtype == np.uint8, "expected uint8 images, got {} for {}".format(
+            dtype, key
+        )
+        return dtype
+    if not np.issubdtype(dtype, np.floating):
+        return dtype
+    if "depth" in key:
+        return np.dtype(args.depth_dtype)
+    if args.obs_dtype != "native":
+        return np.dtype(args.obs_dtype)
+    return dtype
+
+
+def _allocate_obs_buffers(obs, traj_len, args, source_dtypes, prefix=""):
+    """
+    Allocates one array per (possibly nested) observation key in @obs with room for @traj_len
+    timesteps, using the shape of that first observation and the dtype from @_storage_dtype.
+
+    Args:
+        obs (dict): observation of the first timestep
+        traj_len (int): number of timesteps to allocate for
+        args (argparse.Namespace): command line arguments
+        source_dtypes (dict): filled with the original dtype name of every observation that
+            is stored at a different dtype, keyed by its path prefixed with @prefix
+        prefix (str): path of @obs, e.g. "obs/"
+
+    Returns:
+        OrderedDict: same structure as @obs, with (traj_len, ...) arrays as leaves
+    """
+    buffers = OrderedDict()
+    for k, v in obs.items():
+        key = prefix + k
+        if isinstance(v, dict):
+            buffers[k] = _allocate_obs_buffers(
+                v, traj_len, args, source_dtypes, prefix=key + "/"
+            )
+        else:
+            v = np.asarray(v)
+            dtype = _storage_dtype(key, v.dtype, args)
+            if dtype != v.dtype:
+                source_dtypes[key] = v.dtype.name
+            buffers[k] = np.empty((traj_len,) + v.shape, dtype=dtype)
+    return buffers
+
+
+def _store_obs(buffers, obs, t):
+    """
+    Writes observation @obs of timestep @t into the arrays from @_allocate_obs_buffers.
+    Keys of @obs that have no array in @buffers are skipped.
+    """
+    for k, buf in buffers.items():
+        if isinstance(buf, dict):
+            _store_obs(buf, obs[k], t)
+        else:
+            buf[t] = obs[k]
+
+
+def _flatten_obs(obs, prefix="obs/"):
+    """
+    Returns the (possibly nested) observation arrays in @obs as a list of
+    (dataset path, array) pairs, e.g. [("obs/robot0_eef_pos", arr), ...].
+    """
+    obs_flat = []
+    for k, v in obs.items():
+        if isinstance(v, dict):
+            obs_flat.extend(_flatten_obs(v, prefix=prefix + k + "/"))
+        else:
+            obs_flat.append((prefix + k, v))
+    return obs_flat
+
+
+# deflate level used for gzip-compressed observations (h5py's default)
+GZIP_LEVEL = 4
+
+
+def get_compression_kwargs(args):
+    """
+    Returns the keyword arguments passed to @create_dataset for observation datasets, according
+    to the compressor selected on the command line.
+
+    Blosc filters are provided by hdf5plugin, which must also be imported by whoever reads the
+    resulting dataset (playback_dataset and robomimic_dataset_utils do). The byte-shuffle filter
+    groups equal-significance bytes together, which is what makes depth maps and float point
+    clouds compress well.
+    """
+    if args.no_compress:
+        return dict()
+    if args.compressor == "gzip":
+        return dict(compression="gzip", compression_opts=GZIP_LEVEL)
+
+    cname = "zstd" if args.compressor == "blosc_zstd" else "lz4"
+    return dict(
+        hdf5plugin.Blosc(cname=cname, clevel=3, shuffle=hdf5plugin.Blosc.SHUFFLE)
+    )
+
+
+def _pick_chunks(key, arr):
+    """
+    Returns an explicit chunk shape for the compressed dataset storing observation @key.
+    Chunks always span the full trailing dimensions and are cut along time, so that readers
+    fetching a contiguous window of timesteps touch as few chunks as possible:
+
+        - images, depth maps and segmentation masks: one frame per chunk
+        - point clouds: up to 16 timesteps per chunk
+        - low-dimensional observations: up to 64 timesteps per chunk
+    """
+    traj_len = max(arr.shape[0], 1)
+    if "point_cloud" in key:
+        return (min(traj_len, 16),) + arr.shape[1:]
+    if "image" in key or "depth" in key or "segmentation" in key:
+        return (1,) + arr.shape[1:]
+    return (min(traj_len, 64),) + arr.shape[1:]
+
+
+# observations up to this many bytes per episode are stored uncompressed and contiguous
+CONTIGUOUS_MAX_BYTES = 64 * 1024
+
+
+def _is_low_dim(key, arr):
+    """
+    Returns True if observation @key with episode data @arr is small enough to be stored
+    contiguously. Creating a compressed dataset sets up a chunk index and runs the filter
+    pipeline, which for a few KB of joint positions costs more than the bytes it saves.
+    """
+    if "image" in key or "depth" in key or "segmentation" in key or "point_cloud" in key:
+        return False
+    return arr.nbytes <= CONTIGUOUS_MAX_BYTES
+
+
+def _write_deflate_chunks(ds, arr, executor):
+    """
+    Fills the gzip-compressed dataset @ds with @arr by deflating its chunks in parallel on
+    @executor and storing the compressed bytes with HDF5's direct chunk write, which bypasses
+    the single-threaded filter pipeline. The chunks are regular zlib streams, so the result is
+    identical to what the gzip filter would have produced and readable by any HDF5 reader.
+
+    Assumes chunks span the full trailing dimensions, as chosen by @_pick_chunks.
+    """
+    chunk_shape = ds.chunks
+    steps = chunk_shape[0]
+
+    def compress(start):
+        chunk = arr[start : start + steps]
+        if chunk.shape[0] < steps:
+            # HDF5 expects edge chunks padded to the full chunk shape
+            padded = np.zeros(chunk_shape, dtype=arr.dtype)
+            padded[: chunk.shape[0]] = chunk
+            chunk = padded
+        return zlib.compress(chunk.tobytes(), GZIP_LEVEL)
+
+    starts = range(0, arr.shape[0], steps)
+    trailing_offset = (0,) * (arr.ndim - 1)
+    for start, data in zip(starts, executor.map(compress, starts)):
+        ds.id.write_direct_chunk((start,) + trailing_offset, data)
+
+
+def _create_no_fill(grp, name, shape, dtype, chunks, filter_kw):
+    """
+    Creates dataset @name in @grp like create_dataset(shape=..., dtype=..., chunks=...,
+    **filter_kw) would, but through the low-level API so the fill time can be set to never.
+    h5py always writes fill values when space is allocated, which for datasets that we fill
+    completely right after creation is a wasted extra write of every chunk.
+
+    Args:
+        grp (h5py.Group): group to create the dataset in
+        name (str): dataset path relative to @grp, intermediate groups are created
+        shape (tuple): dataset shape
+        dtype (np.dtype): dataset dtype
+        chunks (tuple): chunk shape, or None for contiguous layout
+        filter_kw (dict): compression kwargs from @get_compression_kwargs, requires @chunks
+
+    Returns:
+        h5py.Dataset: the created dataset
+    """
+    dcpl = h5py.h5p.create(h5py.h5p.DATASET_CREATE)
+    dcpl.set_fill_time(h5py.h5d.FILL_TIME_NEVER)
+    if chunks is not None:
+        dcpl.set_chunk(chunks)
+    if filter_kw.get("compression") == "gzip":
+        dcpl.set_deflate(filter_kw["compression_opts"])
+    elif filter_kw:
+        # registered filter plugins such as hdf5plugin's Blosc
+        dcpl.set_filter(
+            filter_kw["compression"],
+            h5py.h5z.FLAG_OPTIONAL,
+            tuple(filter_kw.get("compression_opts", ())),
+        )
+    lcpl = h5py.h5p.create(h5py.h5p.LINK_CREATE)
+    lcpl.set_create_intermediate_group(True)
+    dsid = h5py.h5d.create(
+        grp.id,
+        name.encode(),
+        h5py.h5t.py_create(np.dtype(dtype), logical=True),
+        h5py.h5s.create_simple(shape),
+        dcpl=dcpl,
+        lcpl=lcpl,
+    )
+    return h5py.Dataset(dsid)
+
+
+def _write_obs_dataset(grp, name, arr, obs_kwargs, executor=None, source_dtype=None):
+    """
+    Allocates observation dataset @name in @grp with the final shape and dtype of @arr and
+    fills it with a single write_direct call. Unlike create_dataset(data=...), this does not
+    go through h5py's generic data conversion path, and the chunk shape is known up front.
+    Small low-dimensional observations are stored contiguously without compression.
+
+    Args:
+        grp (h5py.Group): episode group to create the dataset in
+        name (str): dataset path relative to @grp, e.g. "obs/robot0_eef_pos"
+        arr (np.array): observations for the whole episode, time along the first axis
+        obs_kwargs (dict): compression kwargs from @get_compression_kwargs
+        executor (ThreadPoolExecutor): if provided, gzip-compressed datasets are deflated
+            in parallel on this executor
+        source_dtype (str): if provided, stored as the "source_dtype" attribute, to tell
+            loaders which dtype a downcast observation originally had
+
+    Returns:
+        h5py.Dataset: the written dataset
+    """
+    arr = np.ascontiguousarray(arr)
+    if _is_low_dim(name, arr):
+        obs_kwargs = dict()
+    if arr.size == 0:
+        # empty datasets can't use our chunk shapes and have nothing to fill, leave them to h5py
+        ds = grp.create_dataset(name, shape=arr.shape, dtype=arr.dtype, **obs_kwargs)
+    else:
+        ds = _create_no_fill(
+            grp,
+            name,
+            arr.shape,
+            arr.dtype,
+            _pick_chunks(name, arr) if obs_kwargs else None,
+            obs_kwargs,
+        )
+    if source_dtype is not None:
+        ds.attrs["source_dtype"] = source_dtype
+    if arr.size == 0:
+        return ds
+    if executor is not None and obs_kwargs.get("compression") == "gzip":
+        _write_deflate_chunks(ds, arr, executor)
+    else:
+        ds.write_direct(arr)
+    return ds
+
+
+def _file_space_page_size(obs_flat, args):
+    """
+    Returns the file space page size for the output file. Pages should hold at least two of
+    the largest observation chunks, which depends on the observations that are recorded
+    (e.g. 16 point clouds per chunk can be larger than a depth frame, see @_pick_chunks), so
+    it is taken from the (dataset path, array) pairs @obs_flat of the first episode.
+    """
+    chunk_bytes = 0
+    for path, arr in obs_flat:
+        if _is_low_dim(path, arr) or (args.image_codec == "mp4" and "image" in path):
+            # stored contiguously or outside of the file
+            continue
+        chunk_shape = _pick_chunks(path, arr)
+        chunk_bytes = max(chunk_bytes, int(np.prod(chunk_shape)) * arr.itemsize)
+    page_size = 2 * 1024 * 1024
+    while page_size < 2 * chunk_bytes:
+        page_size *= 2
+    return page_size
+
+
+def _open_output_file(output_path, page_size=None):
+    """
+    Creates the output file at @output_path. If @page_size is given, the file uses paged file
+    space management, which aggregates the many small per-episode allocations into whole pages
+    instead of fragmenting the file with small writes.
+    """
+    if page_size is None:
+        return h5py.File(output_path, "w")
+    return h5py.File(
+        output_path,
+        "w",
+        fs_strategy="page",
+        fs_page_size=page_size,
+        fs_persist=True,
+    )
+
+
+def _write_video_obs(grp, name, frames, video_path, output_dir):
+    """
+    Encodes image observations @frames to the mp4 file @video_path instead of storing them in
+    the hdf5 file. Consecutive frames are highly correlated, which a video codec exploits far
+    better than per-chunk compression. Dataset @name in @grp then only holds the frame index of
+    every timestep, and its "video_path" attribute the video location relative to @output_dir.
+
+    Args:
+        grp (h5py.Group): episode group to create the dataset in
+        name (str): dataset path relative to @grp, e.g. "obs/robot0_eye_in_hand_image"
+        frames (np.array): (T, H, W, 3) uint8 image observations
+        video_path (str): path of the mp4 file to write
+        output_dir (str): directory of the output hdf5 file
+
+    Returns:
+        h5py.Dataset: the frame index dataset
+    """
+    # the yuv420p pixel format subsamples chroma by 2 in both directions
+    if frames.shape[1] % 2 != 0 or frames.shape[2] % 2 != 0:
+        raise ValueError(
+            "mp4 encoding needs even image sizes, got {}x{} for {}".format(
+                frames.shape[2], frames.shape[1], name
+            )
+        )
+    os.makedirs(os.path.dirname(video_path), exist_ok=True)
+    # imageio-ffmpeg resizes frames to multiples of macro_block_size by default, which would
+    # make decoded images differ in shape from the recorded ones
+    video_writer = imageio.get_writer(
+        video_path, fps=20, codec="libx264", quality=8, macro_block_size=1
+    )
+    for frame in frames:
+        video_writer.append_data(frame)
+    video_writer.close()
+
+    ds = grp.create_dataset(name, data=np.arange(frames.shape[0], dtype=np.int32))
+    ds.attrs["video_path"] = os.path.relpath(video_path, output_dir)
+    return ds
+
+
+# seconds a worker waits on the full queue before checking again whether the writer is alive
+QUEUE_PUT_TIMEOUT = 5
+
+
+# seconds the writer waits on the empty queue before checking again whether any worker is alive
+QUEUE_GET_TIMEOUT = 5
+
+
+# number of received episodes the writer holds in memory before they are written out
+MAX_PENDING_EPISODES = 4
+
+
+# number of demos between two memory usage reports when --verbose_mem is set
+MEMORY_LOG_INTERVAL = 50
+
+
+def _memory_process():
+    # psutil is only needed for --verbose_mem, so don't require it otherwise
+    import psutil
+
+    return psutil.Process()
+
+
+def _memory_usage_str(mem_proc):
+    """
+    Returns a one-line summary of system memory usage and the resident memory of @mem_proc.
+    """
+    import psutil
+
+    vm = psutil.virtual_memory()
+    return "{}MB used out of {}MB total, {}MB resident in this process".format(
+        vm.used >> 20, vm.total >> 20, mem_proc.memory_info().rss >> 20
+    )
+
+
+""" Handle to an observation array that a worker process placed in shared memory """
+SharedArrayHandle = namedtuple("SharedArrayHandle", ["shm_name", "shape", "dtype"])
+
+
+def _obs_to_shm(obs_flat):
+    """
+    Copies every observation array in @obs_flat into its own shared memory block, so that only
+    small handles are pickled through the queue to the writer process. The blocks are owned by
+    the writer, which unlinks them once the episode has been written.
+
+    Args:
+        obs_flat (list): (dataset path, array) pairs, as returned by @extract_trajectory
+
+    Returns:
+        list: (dataset path, SharedArrayHandle) pairs
+    """
+    handles = []
+    for path, v in obs_flat:
+        if v.nbytes == 0:
+            # shared memory blocks can't be empty - these are cheap to pickle anyway
+            handles.append((path, v))
+            continue
+        shm = shared_memory.SharedMemory(create=True, size=v.nbytes)
+        np.ndarray(v.shape, dtype=v.dtype, buffer=shm.buf)[...] = v
+        handles.append((path, SharedArrayHandle(shm.name, v.shape, v.dtype.str)))
+        shm.close()
+    return handles
+
+
+def _obs_from_shm(handles, shm_blocks):
+    """
+    Inverse of @_obs_to_shm. Maps every SharedArrayHandle in @handles to a numpy array backed
+    directly by its shared memory block, without copying. Attached blocks are appended to
+    @shm_blocks and must be released with @_release_shm once the arrays are no longer referenced.
+    """
+    obs_flat = []
+    for path, v in handles:
+        if isinstance(v, SharedArrayHandle):
+            shm = shared_memory.SharedMemory(name=v.shm_name)
+            shm_blocks.append(shm)
+            v = np.ndarray(v.shape, dtype=np.dtype(v.dtype), buffer=shm.buf)
+        obs_flat.append((path, v))
+    return obs_flat
+
+
+def _unlink_shm(handles):
+    """
+    Unlinks the shared memory blocks of SharedArrayHandles from @_obs_to_shm that will never
+    be mapped by the writer.
+    """
+    for _, v in handles:
+        if isinstance(v, SharedArrayHandle):
+            shm = shared_memory.SharedMemory(name=v.shm_name)
+            shm.close()
+            shm.unlink()
+
+
+def _release_shm(shm_blocks):
+    for shm in shm_blocks:
+        shm.close()
+        shm.unlink()
+
+
 """ The process that writes over the generated files to memory """
 
 
+def _get_from_workers(mul_queue, workers_done):
+    """
+    Gets the next trajectory from @mul_queue, waiting for it as long as any worker is alive.
+    Returns None once @workers_done is set and the queue is empty.
+    """
+    while True:
+        # exited workers have flushed everything they put into the queue, so if they were all
+        # gone before the get started, an empty queue stays empty
+        done = workers_done.is_set()
+        try:
+            return mul_queue.get(timeout=QUEUE_GET_TIMEOUT)
+        except queue.Empty:
+            if done:
+                return None
+
+
 def write_traj_to_file(
-    args, output_path, total_samples, mul_queue
+    args, output_path, num_demos, mul_queue, writer_failed, workers_done
 ):
     f = h5py.File(args.dataset, "r")
-    f_out = h5py.File(output_path, "w")
-    data_grp = f_out.create_group("data")
+    # the output file is created once the first episode arrives, since its page size depends
+    # on the observation shapes
+    f_out = None
+    data_grp = None
+    obs_kwargs = get_compression_kwargs(args)
+    if args.compressor.startswith("blosc"):
+        # Blosc splits every chunk into blocks and compresses them on its own thread pool, whose
+        # size it reads from the environment. This only affects the writer process
+        os.environ["BLOSC_NTHREADS"] = str(args.compression_threads)
+    # with --image_codec mp4, image observations go to one video per episode and camera here
+    video_dir = os.path.splitext(output_path)[0] + "_videos"
+    mem_proc = _memory_process() if args.verbose_mem else None
+    # HDF5's gzip filter is single-threaded, so deflate chunks on our own threads instead
+    compress_executor = None
+    if (
+        not args.no_compress
+        and args.compressor == "gzip"
+        and args.compression_threads > 1
+    ):
+        compress_executor = ThreadPoolExecutor(max_workers=args.compression_threads)
     start_time = time.time()
     num_processed = 0
-
-    try:
-        while num_processed < total_samples:
-            item = mul_queue.get()
-            num_processed = num_processed + 1
-            ep = item[0]
-            traj = item[1]
-            process_num = item[2]
-            try:
-                ep_data_grp = data_grp.create_group(ep)
+    total_samples = 0
+    # h5py serializes all HDF5 calls behind one lock, so a single thread does the writing
+    # while the main thread receives and maps the next episodes from the workers
+    io_executor = ThreadPoolExecutor(max_workers=1)
+    # caps the number of received episodes held in memory that are not written yet
+    pending_slots = threading.Semaphore(MAX_PENDING_EPISODES)
+    pending_writes = []
+
+    def write_episode(ep, traj, process_num, shm_blocks, num_received):
+        try:
+            # extract_trajectory already converted everything to arrays, so write them as-is
+            # instead of paying for another full copy of every observation here
+            assert all(
+                isinstance(arr, np.ndarray) for _, arr in traj["obs_flat"]
+            ), "expected observations as numpy arrays"
+            ep_data_grp = data_grp.create_group(ep)
+            ep_data_grp.create_dataset("actions", data=traj["actions"])
+            if args.global_actions:
                 ep_data_grp.create_dataset(
-                    "actions", data=np.array(traj["actions"])
+                    "global_actions", data=traj["global_actions"]
                 )
-                if args.global_actions:
+            ep_data_grp.create_dataset("states", data=traj["states"])
+            ep_data_grp.create_dataset("rewards", data=traj["rewards"])
+            ep_data_grp.create_dataset("dones", data=traj["dones"])
+            # ep_data_grp.create_dataset(
+            #     "actions_abs", data=np.array(traj["actions_abs"])
+            # )
+            source_dtypes = traj.get("obs_source_dtypes", dict())
+            for path, arr in traj["obs_flat"]:
+                # observation key relative to obs/, e.g. "robot0_eef_pos"
+                k = path.split("/", 1)[1]
+                if args.image_codec == "mp4" and "image" in k:
+                    _write_video_obs(
+                        ep_data_grp,
+                        path,
+                        arr,
+                        os.path.join(video_dir, ep, "{}.mp4".format(k)),
+                        os.path.dirname(output_path),
+                    )
+                    continue
+                _write_obs_dataset(
+                    ep_data_grp,
+                    path,
+                    arr,
+                    obs_kwargs,
+                    executor=compress_executor,
+                    source_dtype=source_dtypes.get(path),
+                )
+                if args.include_next_obs:
+                    _write_obs_dataset(
+                        ep_data_grp,
+                        "next_obs/{}".format(k),
+                        traj["next_obs"][k],
+                        obs_kwargs,
+                        executor=compress_executor,
+                        source_dtype=source_dtypes.get(path),
+                    )
+
+            if "datagen_info" in traj:
+                for k in traj["datagen_info"]:
                     ep_data_grp.create_dataset(
-                        "global_actions", data=np.array(traj["global_actions"])
+                        "datagen_info/{}".format(k),
+                        data=traj["datagen_info"][k],
+                    )
+
+            # copy action dict (if applicable)
+            if "data/{}/action_dict".format(ep) in f:
+                action_dict = f["data/{}/action_dict".format(ep)]
+                for k in action_dict:
+                    ep_data_grp.create_dataset(
+                        "action_dict/{}".format(k),
+                        data=action_dict[k][()],
+                    )
+
+            # episode metadata
+            ep_data_grp.attrs["model_file"] = traj["initial_state_dict"][
+                "model"
+            ]  # model xml for this episode
+            ep_data_grp.attrs["ep_meta"] = traj["initial_state_dict"][
+                "ep_meta"
+            ]  # ep meta data for this episode
+            # if "ep_meta" in f["data/{}".format(ep)].attrs:
+            #     ep_data_grp.attrs["ep_meta"] = f["data/{}".format(ep)].attrs["ep_meta"]
+            ep_data_grp.attrs["num_samples"] = traj["actions"].shape[
+                0
+            ]  # number of transitions in this episode
+        except Exception as e:
+            print("++" * 50)
+            print(
+                f"Error at Process {process_num} on episode {ep} with \n\n {e}"
+            )
+            print("++" * 50)
+            raise Exception("Write out to file has failed")
+        finally:
+            # arrays must not reference the blocks anymore when they get closed, touching
+            # a view on an unmapped block crashes the process
+            traj["obs_flat"].clear()
+            arr = None
+            traj = None
+            _release_shm(shm_blocks)
+            pending_slots.release()
+        print(f"ep {num_received}: wrote {ep_data_grp.attrs['num_samples']} transitions to group {ep} at process {process_num} with {num_received} finished. Datagen rate: {(time.time() - start_time) / num_received} sec/demo")
+        if args.verbose_mem and num_received % MEMORY_LOG_INTERVAL == 0:
+            print(f"Memory usage: {_memory_usage_str(mem_proc)} after writing {ep}", flush=True)
+        return ep_data_grp.attrs["num_samples"]
+
+    try:
+        while num_processed < num_demos:
+            pending_slots.acquire()
+            item = _get_from_workers(mul_queue, workers_done)
+            if item is None:
+                raise RuntimeError(
+                    "All workers have exited after handing over {} of {} demos".format(
+                        num_processed, num_demos
                     )
-                ep_data_grp.create_dataset("states", data=np.array(traj["states"]))
-                ep_data_grp.create_dataset(
-                    "rewards", data=np.array(traj["rewards"])
                 )
-                ep_data_grp.create_dataset("dones", data=np.array(traj["dones"]))
-                # ep_data_grp.create_dataset(
-                #     "actions_abs", data=np.array(traj["actions_abs"])
-                # )
-                for k in traj["obs"]:
-                    total_memory, used_memory, free_memory = map(int, os.popen('free -t -m').readlines()[-1].split()[1:])
-                    print(f"Memory usage: {used_memory}MB used out of {total_memory}MB total before writing {k} at process {process_num}", flush=True)
-                    if isinstance(traj["obs"][k], OrderedDict):
-                        for kp in traj["obs"][k]:
-                            if args.no_compress:
-                                ep_data_grp.create_dataset(
-                                    "obs/{}/{}".format(k, kp),
-                                    data=np.array(traj["obs"][k][kp]),
-                                )
-                            else:
-                                ep_data_grp.create_dataset(
-                                    "obs/{}/{}".format(k, kp),
-                                    data=np.array(traj["obs"][k][kp]),
-                                    compression="gzip",
-                                    chunks=True,
-                                )
-                        continue
-                    if args.no_compress:
-                        ep_data_grp.create_dataset(
-                            "obs/{}".format(k), data=np.array(traj["obs"][k])
-                        )
-                    else:
-                        ep_data_grp.create_dataset(
-                            "obs/{}".format(k),
-                            data=np.array(traj["obs"][k]),
-                            compression="gzip",
-                            chunks=True,
-                        )
-                    if args.include_next_obs:
-                        if args.no_compress:
-                            ep_data_grp.create_dataset(
-                                "next_obs/{}".format(k),
-                                data=np.array(traj["next_obs"][k]),
-                            )
-                        else:
-                            ep_data_grp.create_dataset(
-                                "next_obs/{}".format(k),
-                                data=np.array(traj["next_obs"][k]),
-                                compression="gzip",
-                            )
-
-                if "datagen_info" in traj:
-                    for k in traj["datagen_info"]:
-                        ep_data_grp.create_dataset(
-                            "datagen_info/{}".format(k),
-                            data=np.array(traj["datagen_info"][k]),
-                        )
-
-                # copy action dict (if applicable)
-                if "data/{}/action_dict".format(ep) in f:
-                    action_dict = f["data/{}/action_dict".format(ep)]
-                    for k in action_dict:
-                        ep_data_grp.create_dataset(
-                            "action_dict/{}".format(k),
-                            data=np.array(action_dict[k][()]),
-                        )
-
-                # episode metadata
-                ep_data_grp.attrs["model_file"] = traj["initial_state_dict"][
-                    "model"
-                ]  # model xml for this episode
-                ep_data_grp.attrs["ep_meta"] = traj["initial_state_dict"][
-                    "ep_meta"
-                ]  # ep meta data for this episode
-                # if "ep_meta" in f["data/{}".format(ep)].attrs:
-                #     ep_data_grp.attrs["ep_meta"] = f["data/{}".format(ep)].attrs["ep_meta"]
-                ep_data_grp.attrs["num_samples"] = traj["actions"].shape[
-                    0
-                ]  # number of transitions in this episode
-
-                total_samples += traj["actions"].shape[0]
-            except Exception as e:
-                print("++" * 50)
-                print(
-                    f"Error at Process {process_num} on episode {ep} with \n\n {e}"
+            ep, traj, process_num = item
+            num_processed = num_processed + 1
+            shm_blocks = []
+            traj["obs_flat"] = _obs_from_shm(traj["obs_flat"], shm_blocks)
+            if f_out is None:
+                f_out = _open_output_file(
+                    output_path, _file_space_page_size(traj["obs_flat"], args)
+                )
+                data_grp = f_out.create_group("data")
+            pending_writes.append(
+                io_executor.submit(
+                    write_episode, ep, traj, process_num, shm_blocks, num_processed
                 )
-                print("++" * 50)
-                raise Exception("Write out to file has failed")
-            print(f"ep {num_processed}: wrote {ep_data_grp.attrs['num_samples']} transitions to group {ep} at process {process_num} with {num_processed} finished. Datagen rate: {(time.time() - start_time) / num_processed} sec/demo")
+            )
+            traj = None
+            # collect finished writes, which also re-raises errors from the writer thread
+            while pending_writes and pending_writes[0].done():
+                total_samples += pending_writes.pop(0).result()
+        for future in pending_writes:
+            total_samples += future.result()
     except KeyboardInterrupt:
         print("Control C pressed. Closing File and ending \n\n\n\n\n\n\n")
+    except Exception:
+        # workers would otherwise block forever on the full queue
+        writer_failed.set()
+        io_executor.shutdown()
+        if compress_executor is not None:
+            compress_executor.shutdown()
+        if f_out is not None:
+            f_out.close()
+        f.close()
+        raise
+
+    if f_out is None:
+        # no episode was received
+        f_out = _open_output_file(output_path)
+        data_grp = f_out.create_group("data")
 
     if "mask" in f:
         f.copy("mask", f_out)
@@ -306,47 +900,49 @@ def write_traj_to_file(
     # )  # environment info
     print("Wrote {} total samples to {}".format(total_samples, output_path))
 
+    io_executor.shutdown()
+    if compress_executor is not None:
+        compress_executor.shutdown()
     f_out.close()
     f.close()
 
     DatasetUtils.extract_action_dict(dataset=output_path)
     # DatasetUtils.make_demo_ids_contiguous(dataset=output_path)
-    for num_demos in [
-        10,
-        20,
-        30,
-        40,
-        50,
-        60,
-        70,
-        75,
-        80,
-        90,
-        100,
-        125,
-        150,
-        200,
-        250,
-        300,
-        400,
-        500,
-        600,
-        700,
-        800,
-        900,
-        1000,
-        1500,
-        2000,
-        2500,
-        3000,
-        4000,
-        5000,
-        10000,
-    ]:
-        DatasetUtils.filter_dataset_size(
-            output_path,
-            num_demos=num_demos,
-        )
+    DatasetUtils.filter_dataset_sizes(
+        output_path,
+        num_demos_list=[
+            10,
+            20,
+            30,
+            40,
+            50,
+            60,
+            70,
+            75,
+            80,
+            90,
+            100,
+            125,
+            150,
+            200,
+            250,
+            300,
+            400,
+            500,
+            600,
+            700,
+            800,
+            900,
+            1000,
+            1500,
+            2000,
+            2500,
+            3000,
+            4000,
+            5000,
+            10000,
+        ],
+    )
 
     print("Writing has finished")
 
@@ -359,16 +955,35 @@ def write_traj_to_file(
     return
 
 
-# runs multiple trajectory. If there has been an unrecoverable error, the system puts the current work back into the queue and exits
+# runs multiple trajectory. If there has been an unrecoverable error, the system puts the current work into the deadletter queue and exits
 def extract_multiple_trajectories(
-    process_num, current_work_array, work_queue, lock, args2, mul_queue
+    process_num,
+    current_work_array,
+    next_index,
+    deadletter_dir,
+    deadletter_size,
+    args2,
+    mul_queue,
+    writer_failed,
 ):
     try:
         extract_multiple_trajectories_with_error(
-            process_num, current_work_array, work_queue, lock, args2, mul_queue
+            process_num,
+            current_work_array,
+            next_index,
+            deadletter_dir,
+            deadletter_size,
+            args2,
+            mul_queue,
+            writer_failed,
         )
     except Exception as e:
-        work_queue.put(current_work_array[process_num])
+        # only retry a demo if this worker actually held one when it crashed
+        if current_work_array[process_num] != -1:
+            deadletter = SQLitePersistQueue(deadletter_dir, auto_commit=True)
+            with next_index.get_lock():
+                deadletter.put(current_work_array[process_num])
+                deadletter_size.value += 1
         print("*>*" * 50)
         print("Error process num {}:".format(process_num))
         print(e)
@@ -377,20 +992,58 @@ def extract_multiple_trajectories(
         print()
 
 
-def retrieve_new_index(process_num, current_work_array, work_queue, lock):
-    with lock:
-        if work_queue.empty():
-            return -1
+def retrieve_new_index(
+    process_num,
+    current_work_array,
+    next_index,
+    num_demos,
+    deadletter,
+    deadletter_size,
+):
+    """
+    Claims the next demo index to process, or returns -1 once all demos have been handed out.
+    Indices are handed out by incrementing the shared counter @next_index. Indices that a failed
+    worker put into @deadletter are retried first. Taking an item from @deadletter is a SELECT
+    followed by a DELETE, which is not atomic across processes, so it also happens under the
+    lock of @next_index. @deadletter_size counts its items, so that the database is only
+    queried when there is something to retry.
+    """
+    with next_index.get_lock():
+        if deadletter_size.value > 0:
+            ind = deadletter.get(block=False)
+            deadletter_size.value -= 1
+        else:
+            ind = next_index.value
+            next_index.value += 1
+    if ind >= num_demos:
+        ind = -1
+    current_work_array[process_num] = ind
+    return ind
+
+
+def _put_to_writer(mul_queue, item, writer_failed):
+    """
+    Puts @item into @mul_queue, waiting for free space as long as the writer is alive.
+    Returns False without putting @item if @writer_failed got set in the meantime.
+    """
+    while not writer_failed.is_set():
         try:
-            tmp = work_queue.get(False)
-            current_work_array[process_num] = tmp
-            return tmp
-        except queue.Empty:
-            return -1
+            mul_queue.put(item, timeout=QUEUE_PUT_TIMEOUT)
+            return True
+        except queue.Full:
+            pass
+    return False
 
 
 def extract_multiple_trajectories_with_error(
-    process_num, current_work_array, work_queue, lock, args, mul_queue
+    process_num,
+    current_work_array,
+    next_index,
+    deadletter_dir,
+    deadletter_size,
+    args,
+    mul_queue,
+    writer_failed,
 ):
     # create environment to use for data processing
 
@@ -429,8 +1082,19 @@ def extract_multiple_trajectories_with_error(
     if args.n is not None:
         demos = demos[: args.n]
 
-    ind = retrieve_new_index(process_num, current_work_array, work_queue, lock)
-    while (not work_queue.empty()) and (ind != -1):
+    mem_proc = _memory_process() if args.verbose_mem else None
+    num_extracted = 0
+
+    deadletter = SQLitePersistQueue(deadletter_dir, auto_commit=True)
+    ind = retrieve_new_index(
+        process_num,
+        current_work_array,
+        next_index,
+        len(demos),
+        deadletter,
+        deadletter_size,
+    )
+    while ind != -1 and not writer_failed.is_set():
         try:
             # print("Running {} index".format(ind))
             ep = demos[ind]
@@ -474,16 +1138,26 @@ def extract_multiple_trajectories_with_error(
             # IMPORTANT: keep name of group the same as source file, to make sure that filter keys are
             #            consistent as well
             # print("(process {}): ADD TO QUEUE index {}".format(process_num, ind))
-            total_memory, used_memory, free_memory = map(int, os.popen('free -t -m').readlines()[-1].split()[1:])
-            print(f"Memory usage: {used_memory}MB used out of {total_memory}MB total before putting {ep} at process {process_num}", flush=True)
-
-            mul_queue.put([ep, traj, process_num])
-
-            total_memory, used_memory, free_memory = map(int, os.popen('free -t -m').readlines()[-1].split()[1:])
-            print(f"Memory usage: {used_memory}MB used out of {total_memory}MB total after putting {ep} at process {process_num}", flush=True)
-
-
-            ind = retrieve_new_index(process_num, current_work_array, work_queue, lock)
+            traj["obs_flat"] = _obs_to_shm(traj["obs_flat"])
+            if not _put_to_writer(mul_queue, [ep, traj, process_num], writer_failed):
+                # nobody is going to unlink the blocks of this trajectory anymore
+                _unlink_shm(traj["obs_flat"])
+                break
+            # the writer owns this demo now, a crash from here on must not retry it
+            current_work_array[process_num] = -1
+
+            num_extracted += 1
+            if args.verbose_mem and num_extracted % MEMORY_LOG_INTERVAL == 0:
+                print(f"Memory usage: {_memory_usage_str(mem_proc)} after putting {ep} at process {process_num}", flush=True)
+
+            ind = retrieve_new_index(
+                process_num,
+                current_work_array,
+                next_index,
+                len(demos),
+                deadletter,
+                deadletter_size,
+            )
         except Exception as e:
             print("_" * 50)
             print("Process {}:".format(process_num))
@@ -494,6 +1168,11 @@ def extract_multiple_trajectories_with_error(
             env = create_env_with_wrappers(env_meta["env_name"], args)
 
     f.close()
+    if writer_failed.is_set():
+        # items still buffered for the dead writer must not keep this process from exiting
+        mul_queue.cancel_join_thread()
+        print("Process {} stopped, the writer has failed".format(process_num))
+        return
     print("Process {} finished".format(process_num))
 
 
@@ -514,6 +1193,12 @@ def create_env_with_wrappers(env_name, args):
 
 
 def dataset_states_to_obs_multiprocessing(args):
+    if args.image_codec == "mp4" and (args.camera_height % 2 or args.camera_width % 2):
+        # fail before extracting anything instead of in the writer
+        raise ValueError(
+            "--image_codec mp4 needs an even --camera_height and --camera_width"
+        )
+
     # create environment to use for data processing
 
     # output file in same directory as input file
@@ -561,50 +1246,80 @@ def dataset_states_to_obs_multiprocessing(args):
     env_meta = DatasetUtils.get_env_metadata_from_dataset(dataset_path=args.dataset)
     num_processes = args.num_procs
 
-    lock = multiprocessing.Lock()
-
     persist_queue_dir = os.path.join(os.path.dirname(args.dataset), "persist_queue")
     if not os.path.exists(persist_queue_dir):
         os.makedirs(persist_queue_dir)
-    mul_queue = PersistQueue(persist_queue_dir, autosave=True)
-
-    work_queue = multiprocessing.Queue()
-    for index in range(num_demos):
-        work_queue.put(index)
-    current_work_array = multiprocessing.Array("i", num_processes)
-    processes = []
-    # for i in range(num_processes):
-    #     process = multiprocessing.Process(
-    #         target=extract_multiple_trajectories,
-    #         args=(
-    #             i,
-    #             current_work_array,
-    #             work_queue,
-    #             lock,
-    #             args,
-    #             mul_queue,
-    #         ),
-    #     )
-    #     processes.append(process)
-
-    extract_multiple_trajectories(0, current_work_array, work_queue, lock, args, mul_queue)
-
-    # process1 = multiprocessing.Process(
-    #     target=write_traj_to_file,
-    #     args=(
-    #         args,
-    #         output_path,
-    #         num_demos,
-    #         mul_queue,
-    #     ),
-    # )
-    # processes.append(process1)
+    # demo indices whose extraction crashed a worker, to be picked up again by the others
+    deadletter_dir = os.path.join(persist_queue_dir, "deadletter")
+    if os.path.exists(deadletter_dir):
+        # left over from a previous run
+        shutil.rmtree(deadletter_dir)
+    # create it before forking, workers opening the queue at the same time would race on it
+    os.makedirs(deadletter_dir)
+
+    # trajectories go to the writer as shared memory handles, so the queue itself stays small.
+    # Bounding it keeps workers from running too far ahead of the writer.
+    mul_queue = multiprocessing.Queue(maxsize=2 * num_processes)
+    # start the resource tracker before forking so that all processes share it. Otherwise each
+    # worker gets its own tracker, which unlinks the worker's blocks as soon as it exits, even if
+    # the writer has not consumed them yet
+    resource_tracker.ensure_running()
+    # set when the writer dies, so that the workers stop instead of waiting for it forever
+    writer_failed = multiprocessing.Event()
+    # set once all workers have exited, so that the writer stops waiting for missing demos
+    workers_done = multiprocessing.Event()
+
+    next_index = multiprocessing.Value("i", 0)
+    # number of indices in the dead-letter queue, guarded by the lock of @next_index
+    deadletter_size = multiprocessing.Value("i", 0, lock=False)
+    # demo index each worker is currently extracting, -1 if none
+    current_work_array = multiprocessing.Array("i", [-1] * num_processes)
+    worker_processes = []
+    for i in range(num_processes):
+        process = multiprocessing.Process(
+            target=extract_multiple_trajectories,
+            args=(
+                i,
+                current_work_array,
+                next_index,
+                deadletter_dir,
+                deadletter_size,
+                args,
+                mul_queue,
+                writer_failed,
+            ),
+        )
+        worker_processes.append(process)
+
+    process1 = multiprocessing.Process(
+        target=write_traj_to_file,
+        args=(
+            args,
+            output_path,
+            num_demos,
+            mul_queue,
+            writer_failed,
+            workers_done,
+        ),
+    )
+    processes = worker_processes + [process1]
 
     for process in processes:
         process.start()
 
+    # wait for the writer first: if it got killed without setting the event, the workers
+    # would never finish. Workers that died also never hand over their remaining demos, so
+    # tell the writer once none are left
+    while process1.is_alive():
+        process1.join(timeout=QUEUE_GET_TIMEOUT)
+        if not any(process.is_alive() for process in worker_processes):
+            workers_done.set()
+    if process1.exitcode != 0:
+        writer_failed.set()
     for process in processes:
         process.join()
+    if writer_failed.is_set():
+        raise RuntimeError("Writing {} has failed".format(output_path))
 
     print("Finished Multiprocessing")
     return
@@ -709,11 +1424,28 @@ if __name__ == "__main__":
         help="(optional) include next obs in dataset",
     )
 
-    # flag to disable compressing observations with gzip option in hdf5
+    # flag to disable compressing observations in hdf5
     parser.add_argument(
         "--no_compress",
         action="store_true",
-        help="(optional) disable compressing observations with gzip option in hdf5",
+        help="(optional) disable compressing observations in hdf5",
+    )
+
+    # compression filter for observations. Blosc filters require hdf5plugin to read the dataset
+    parser.add_argument(
+        "--compressor",
+        type=str,
+        default="blosc_zstd",
+        choices=["gzip", "blosc_zstd", "blosc_lz4"],
+        help="(optional) hdf5 filter used to compress observations. blosc_zstd favors ratio,\
+            blosc_lz4 favors throughput, gzip needs no plugin to read back",
+    )
+
+    parser.add_argument(
+        "--compression_threads",
+        type=int,
+        default=max(os.cpu_count() // 2, 1),
+        help="(optional) number of threads the writer uses to compress observations",
     )
 
     parser.add_argument(
@@ -783,5 +1515,38 @@ if __name__ == "__main__":
         help="whether to store depth observations",
     )
 
+    parser.add_argument(
+        "--image_codec",
+        type=str,
+        default="h5",
+        choices=["h5", "mp4"],
+        help="(optional) how to store image observations. h5 stores them as hdf5 datasets,\
+            mp4 encodes them with H.264 into a <output>_videos directory next to the dataset\
+            and only stores frame indices in hdf5",
+    )
+
+    parser.add_argument(
+        "--depth_dtype",
+        type=str,
+        default="float16",
+        choices=["float16", "float32"],
+        help="(optional) dtype depth observations are stored with",
+    )
+
+    parser.add_argument(
+        "--obs_dtype",
+        type=str,
+        default="native",
+        choices=["native", "float16"],
+        help="(optional) dtype other float observations are stored with. native keeps the\
+            dtype returned by the environment",
+    )
+
+    parser.add_argument(
+        "--verbose_mem",
+        action="store_true",
+        help="(optional) periodically print memory usage of workers and writer (requires psutil)",
+    )
+
     args = parser.parse_args()
     dataset_states_to_obs_multiprocessing(args)
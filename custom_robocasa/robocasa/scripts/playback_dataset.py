@@ -5,6 +5,9 @@ import random
 import time
 
 import h5py
+
+# registers the Blosc filters that dataset_states_to_obs compresses observations with
+import hdf5plugin
 import imageio
 import numpy as np
 import robosuite
@@ -130,6 +133,29 @@ def playback_trajectory_with_env(
         env.viewer = None
 
 
+def get_image_obs(obs_ds):
+    """
+    Returns the image observations of dataset @obs_ds, indexable by timestep. Datasets written with
+    dataset_states_to_obs --image_codec mp4 only hold frame indices and a "video_path" attribute
+    pointing to an mp4 next to the hdf5 file. These videos are decoded here.
+
+    Args:
+        obs_ds (h5py.Dataset): image observation dataset, e.g. traj_grp["obs/robot0_agentview_left_image"]
+
+    Returns:
+        h5py.Dataset or np.array: (T, H, W, 3) image observations
+    """
+    if "video_path" not in obs_ds.attrs:
+        return obs_ds
+    video_path = os.path.join(
+        os.path.dirname(obs_ds.file.filename), obs_ds.attrs["video_path"]
+    )
+    video_reader = imageio.get_reader(video_path)
+    frames = np.stack([frame for frame in video_reader])
+    video_reader.close()
+    return frames[obs_ds[()]]
+
+
 def playback_trajectory_with_obs(
     traj_grp,
     video_writer,
@@ -154,11 +180,14 @@ def playback_trajectory_with_obs(
     ), "error: must specify at least one image observation to use in @image_names"
     video_count = 0
 
-    traj_len = traj_grp["obs/{}".format(image_names[0] + "_image")].shape[0]
+    image_obs = [
+        get_image_obs(traj_grp["obs/{}".format(k + "_image")]) for k in image_names
+    ]
+    traj_len = image_obs[0].shape[0]
     for i in range(traj_len):
         if video_count % video_skip == 0:
             # concatenate image obs together
-            im = [traj_grp["obs/{}".format(k + "_image")][i] for k in image_names]
+            im = [obs[i] for obs in image_obs]
             frame = np.concatenate(im, axis=1)
             video_writer.append_data(frame)
         video_count += 1
@@ -1,5 +1,4 @@
 import os
-import time
 import numpy as np
 import tempfile
 import random
@@ -15,56 +14,25 @@ import robosuite.utils.transform_utils as T
 
 import robosuite_model_zoo
 
+from robocasa.models.objects.objects import _BBOX_SIGNS, _rewrite_asset_paths
+
+# folder of the installed robosuite-model-zoo package, which asset paths in MJCF files get
+# rebased onto
+_RMZ_PATH = os.path.dirname(os.path.split(robosuite_model_zoo.__file__)[0])
+# asset path rewrites on top of the robosuite one
+_RMZ_PACKAGES = {"robosuite-model-zoo-dev": _RMZ_PATH}
+
 
 def postprocess_model_xml(xml_str):
     """
-    New version of postprocess model xml that only replaces robosuite file paths if necessary (otherwise
-    there is an error with the "max" operation), and also replaces robosuite-model-zoo file paths
-    if necessary.
+    New version of postprocess model xml that only replaces file paths pointing into a robosuite or
+    robosuite-model-zoo folder, and leaves all other asset paths untouched.
     """
-
-    path = os.path.split(robosuite.__file__)[0]
-    path_split = path.split("/")
-
-    # replace mesh and texture file paths
-    tree = ET.fromstring(xml_str)
-    root = tree
-    asset = root.find("asset")
-    meshes = asset.findall("mesh")
-    textures = asset.findall("texture")
-    all_elements = meshes + textures
-
-    for elem in all_elements:
-        old_path = elem.get("file")
-        if old_path is None:
-            continue
-
-        old_path_split = old_path.split("/")
-        # maybe replace all paths to robosuite assets
-        check_lst = [
-            loc for loc, val in enumerate(old_path_split) if val == "robosuite"
-        ]
-        if len(check_lst) > 0:
-            ind = max(check_lst)  # last occurrence index
-            new_path_split = path_split + old_path_split[ind + 1 :]
-            new_path = "/".join(new_path_split)
-            elem.set("file", new_path)
-
-        # maybe replace all paths to robosuite model zoo assets
-        check_lst = [
-            loc
-            for loc, val in enumerate(old_path_split)
-            if val == "robosuite-model-zoo-dev"
-        ]
-        if len(check_lst) > 0:
-            ind = max(check_lst)  # last occurrence index
-            new_path_split = (
-                os.path.split(robosuite_model_zoo.__file__)[0].split("/")[:-1]
-                + old_path_split[ind + 1 :]
-            )
-            new_path = "/".join(new_path_split)
-            elem.set("file", new_path)
-
+    # every rewrite needs a "robosuite" path component, so skip the round trip if there is none
+    if "robosuite" not in xml_str:
+        return xml_str
+    root = ET.fromstring(xml_str)
+    _rewrite_asset_paths(root, _RMZ_PACKAGES)
     return ET.tostring(root, encoding="utf8").decode("utf8")
 
 
@@ -106,26 +74,53 @@ class MJCFObject(MujocoXMLObject):
 
         self.rgba = rgba
 
+        # attributes for _get_geoms, which sets them on every geom of the object
+        self._geom_attrs = {
+            "solref": array_to_string(solref),
+            "solimp": array_to_string(solimp),
+            "density": str(density),
+            "friction": array_to_string(friction),
+        }
+        if margin is not None:
+            self._geom_attrs["margin"] = str(margin)
+        if priority is not None:
+            # set high priorit
+            self._geom_attrs["priority"] = str(priority)
+        self._rgba_str = array_to_string(rgba) if rgba is not None else None
+
+        # filled by _get_site_offsets
+        self._site_offsets = None
+
         # read default xml
         xml_path = mjcf_path
-        folder = os.path.dirname(xml_path)
+        # hand the parsed tree to robosuite directly instead of serializing it for robosuite to parse again
         tree = ET.parse(xml_path)
         root = tree.getroot()
 
         # modify mesh scales
         asset = root.find("asset")
         meshes = asset.findall("mesh")
+        scale_str = array_to_string(scale)
         for mesh in meshes:
             # if a scale already exists, multiply the scales
-            scale_to_set = scale
             existing_scale = mesh.get("scale")
-            if existing_scale is not None:
-                scale_to_set = string_to_array(existing_scale) * scale
-            mesh.set("scale", array_to_string(scale_to_set))
+            if existing_scale is None:
+                mesh.set("scale", scale_str)
+            else:
+                mesh.set(
+                    "scale", array_to_string(string_to_array(existing_scale) * scale)
+                )
 
         # modify sites for collision (assumes we can just scale up the locations - may or may not work)
-        for n in ["bottom_site", "top_site", "horizontal_radius_site"]:
-            site = root.find("worldbody/body/site[@name='{}']".format(n))
+        # collect the three sites in a single pass over the body's sites
+        site_names = ("bottom_site", "top_site", "horizontal_radius_site")
+        sites = dict()
+        for site in root.iterfind("worldbody/body/site"):
+            if site.get("name") in site_names:
+                # keep the first match, like find() did
+                sites.setdefault(site.get("name"), site)
+        for n in site_names:
+            site = sites[n]
             pos = string_to_array(site.get("pos"))
             pos = scale * pos
             site.set("pos", array_to_string(pos))
@@ -147,30 +142,45 @@ class MJCFObject(MujocoXMLObject):
             g.set("contype", "2")
         """
 
-        # write modified xml (and make sure to postprocess any paths just in case)
-        xml_str = ET.tostring(root, encoding="utf8").decode("utf8")
-        xml_str = postprocess_model_xml(xml_str)
-        time_str = str(time.time()).replace(".", "_")
-        new_xml_path = os.path.join(folder, "{}_{}.xml".format(time_str, os.getpid()))
-        f = open(new_xml_path, "w")
-        f.write(xml_str)
-        f.close()
-        # print(f"Write to {new_xml_path}")
-
-        # initialize object with new xml we wrote
+        # make sure to postprocess any paths just in case
+        _rewrite_asset_paths(root, _RMZ_PACKAGES)
+
+        # initialize object from the modified xml, relative asset paths resolve against @mjcf_path
         super().__init__(
             # xml_path_completion("objects/{}.xml".format(obj_name)),
-            fname=new_xml_path,
+            fname=xml_path,
             name=name,
             joints=[dict(type="free", damping="0.0005")],
             # joints=None,
             obj_type="all",
             duplicate_collision_geoms=False,
+            root=root,
         )
 
-        # clean up xml - we don't need it anymore
-        if os.path.exists(new_xml_path):
-            os.remove(new_xml_path)
+    def set_scale(self, scale, obj=None):
+        """
+        Scales each geom, mesh, site, and body. The site positions cached for the bbox queries move
+        with the sites, so they get looked up again on next use
+        """
+        super().set_scale(scale, obj=obj)
+        self._site_offsets = None
+
+    def _get_site_offsets(self):
+        """
+        Returns the (horizontal radius, bottom offset, top offset) site positions used by the bbox
+        queries. The sites only move when the object is rescaled, so they are looked up once and
+        cached until then
+        """
+        if self._site_offsets is None:
+            horizontal_radius_site = self.worldbody.find(
+                "./body/site[@name='{}horizontal_radius_site']".format(self.naming_prefix)
+            )
+            self._site_offsets = (
+                string_to_array(horizontal_radius_site.get("pos"))[:2],
+                self.bottom_offset,
+                self.top_offset,
+            )
+        return self._site_offsets
 
     def _get_geoms(self, root, _parent=None):
         """
@@ -189,43 +199,24 @@ class MJCFObject(MujocoXMLObject):
 
         # modify geoms according to the attributes
         for i, (parent, element) in enumerate(geom_pairs):
-            element.set("solref", array_to_string(self.solref))
-            element.set("solimp", array_to_string(self.solimp))
-            element.set("density", str(self.density))
-            element.set("friction", array_to_string(self.friction))
-            if self.margin is not None:
-                element.set("margin", str(self.margin))
+            element.attrib.update(self._geom_attrs)
 
             if (self.rgba is not None) and (element.get("group") == "1"):
-                element.set("rgba", array_to_string(self.rgba))
-
-            if self.priority is not None:
-                # set high priorit
-                element.set("priority", str(self.priority))
+                element.set("rgba", self._rgba_str)
 
         return geom_pairs
 
     @property
     def horizontal_radius(self):
-        horizontal_radius_site = self.worldbody.find(
-            "./body/site[@name='{}horizontal_radius_site']".format(self.naming_prefix)
-        )
-        site_values = string_to_array(horizontal_radius_site.get("pos"))
-        return np.linalg.norm(site_values[0:2])
+        horiz_radius, _, _ = self._get_site_offsets()
+        return np.linalg.norm(horiz_radius)
 
     def get_bbox_points(self, trans=None, rot=None):
         """
-        Get the full 8 bounding box points of the object
+        Get the full 8 bounding box points of the object, as an (8, 3) array
         rot: a rotation matrix
         """
-        bbox_offsets = []
-
-        bottom_offset = self.bottom_offset
-        top_offset = self.top_offset
-        horizontal_radius_site = self.worldbody.find(
-            "./body/site[@name='{}horizontal_radius_site']".format(self.naming_prefix)
-        )
-        horiz_radius = string_to_array(horizontal_radius_site.get("pos"))[:2]
+        horiz_radius, bottom_offset, top_offset = self._get_site_offsets()
 
         center = np.mean([bottom_offset, top_offset], axis=0)
         half_size = [horiz_radius[0], horiz_radius[1], top_offset[2] - center[2]]
@@ -233,16 +224,7 @@ class MJCFObject(MujocoXMLObject):
         # center = np.array([0, 0, 0])
         # half_size = np.array([0.01, 0.01, 0.01])
 
-        bbox_offsets = [
-            center + half_size * np.array([-1, -1, -1]),  # p0
-            center + half_size * np.array([1, -1, -1]),  # px
-            center + half_size * np.array([-1, 1, -1]),  # py
-            center + half_size * np.array([-1, -1, 1]),  # pz
-            center + half_size * np.array([1, 1, 1]),
-            center + half_size * np.array([-1, 1, 1]),
-            center + half_size * np.array([1, -1, 1]),
-            center + half_size * np.array([1, 1, -1]),
-        ]
+        corners = center + _BBOX_SIGNS * half_size
 
         if trans is None:
             trans = np.array([0, 0, 0])
@@ -251,5 +233,5 @@ class MJCFObject(MujocoXMLObject):
         else:
             rot = np.eye(3)
 
-        points = [(np.matmul(rot, p) + trans) for p in bbox_offsets]
-        return points
+        # rotate all corners with a single matmul, one corner per row
+        return corners @ rot.T + trans
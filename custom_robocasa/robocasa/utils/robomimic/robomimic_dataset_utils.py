@@ -1,5 +1,8 @@
 import os
 import h5py
+
+# registers the Blosc filters that dataset_states_to_obs compresses observations with
+import hdf5plugin
 import json
 import torch
 import numpy as np
@@ -203,13 +206,7 @@ def filter_dataset_size(
     f.close()
 
     # get random split
-    total_num_demos = len(demos)
-    mask = np.zeros(total_num_demos)
-    mask[:num_demos] = 1.0
-    np.random.shuffle(mask)
-    mask = mask.astype(int)
-    subset_inds = mask.nonzero()[0]
-    subset_keys = [demos[i] for i in subset_inds]
+    subset_keys = _random_demo_subset(demos, num_demos)
 
     # pass mask to generate split
     if output_filter_key is not None:
@@ -225,6 +222,58 @@ def filter_dataset_size(
     )
 
 
+def filter_dataset_sizes(hdf5_path, num_demos_list, input_filter_key=None):
+    """
+    Equivalent to calling @filter_dataset_size for every entry of @num_demos_list, but opens
+    the hdf5 file once for all filter keys instead of twice per key. Filter keys only store
+    the names of the selected demos under mask/, so no episode data is read or copied.
+
+    Args:
+        hdf5_path (str): path to hdf5 file
+        num_demos_list ([int]): number of demos in each filter key to create
+        input_filter_key (str): if provided, sample demos from this filter key instead of
+            all demos, and prefix the created filter keys with it
+    """
+    f = h5py.File(hdf5_path, "a")
+    if input_filter_key is not None:
+        print("using filter key: {}".format(input_filter_key))
+        demos = sorted(
+            [
+                elem.decode("utf-8")
+                for elem in np.array(f["mask/{}".format(input_filter_key)])
+            ]
+        )
+    else:
+        demos = sorted(list(f["data"].keys()))
+
+    for num_demos in num_demos_list:
+        subset_keys = _random_demo_subset(demos, num_demos)
+
+        name = "{}_demos".format(num_demos)
+        if input_filter_key is not None:
+            name = "{}_{}".format(input_filter_key, name)
+
+        k = "mask/{}".format(name)
+        if k in f:
+            del f[k]
+        f[k] = np.array(subset_keys, dtype="S")
+
+    f.close()
+
+
+def _random_demo_subset(demos, num_demos):
+    """
+    Returns a random subset of @num_demos demo keys from @demos, preserving their order.
+    """
+    total_num_demos = len(demos)
+    mask = np.zeros(total_num_demos)
+    mask[:num_demos] = 1.0
+    np.random.shuffle(mask)
+    mask = mask.astype(int)
+    subset_inds = mask.nonzero()[0]
+    return [demos[i] for i in subset_inds]
+
+
 def move_demo_to_new_key(f, old_demo_key, new_demo_key, delete_old_demo=True):
     print(f"Moving {old_demo_key} -> {new_demo_key}")
 
@@ -390,8 +439,4 @@ def convert_to_robomimic_format(
 
     # create filter keys according to number of demos
     if filter_num_demos is not None:
-        for n in filter_num_demos:
-            filter_dataset_size(
-                dataset,
-                num_demos=n,
-            )
+        filter_dataset_sizes(dataset, num_demos_list=filter_num_demos)
@@ -27,7 +27,9 @@ setup(
         "tqdm",
         "termcolor",
         "imageio",
+        "imageio-ffmpeg",
         "h5py",
+        "hdf5plugin",
         "lxml",
         "hidapi",
         "tianshou==0.4.10",
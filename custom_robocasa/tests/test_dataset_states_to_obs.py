@@ -0,0 +1,187 @@
+import argparse
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import h5py
+import numpy as np
+
+from robocasa.scripts.dataset_states_to_obs import (
+    _global_actions,
+    _write_obs_dataset,
+    _write_video_obs,
+    get_compression_kwargs,
+)
+from robocasa.scripts.playback_dataset import get_image_obs
+from robocasa.utils.transform_utils import (
+    axisangle2quat_numpy,
+    mat2quat_numpy,
+    quat2axisangle_numpy,
+    quat2mat_numpy,
+)
+
+
+def random_rotation(rng):
+    q, r = np.linalg.qr(rng.normal(size=(3, 3)))
+    q = q * np.sign(np.diag(r))
+    if np.linalg.det(q) < 0:
+        q[:, 0] *= -1
+    return q
+
+
+def reference_global_actions(base_rot, actions):
+    """
+    Conversion that @_global_actions replaced: rotate the position delta and conjugate the
+    rotation delta by the base rotation, going through quaternions and rotation matrices.
+    """
+    out = actions.copy()
+    out[:, :3] = np.einsum("ij,nj->ni", base_rot, actions[:, :3])
+    rot_mats = quat2mat_numpy(axisangle2quat_numpy(actions[:, 3:6]))
+    out[:, 3:6] = quat2axisangle_numpy(
+        mat2quat_numpy(np.einsum("ij,njk,kl->nil", base_rot, rot_mats, base_rot.T))
+    )
+    return out
+
+
+def compression_args(compressor):
+    return argparse.Namespace(
+        no_compress=False, compressor=compressor, compression_threads=2
+    )
+
+
+class TestGlobalActions(unittest.TestCase):
+    def test_matches_reference(self):
+        """
+        Compares the kernel against the quaternion round trip for random rotations, including
+        zero rotations and rotation vectors longer than pi, which both get canonicalized.
+        """
+        rng = np.random.default_rng(0)
+        actions = rng.uniform(-1.0, 1.0, size=(64, 12))
+        axes = rng.normal(size=(64, 3))
+        axes /= np.linalg.norm(axes, axis=1, keepdims=True)
+        angles = rng.uniform(0.0, 3.0, size=64)
+        angles[:8] = 0.0
+        angles[8:24] = rng.uniform(3.3, 6.0, size=16)
+        actions[:, 3:6] = axes * angles[:, None]
+
+        for _ in range(4):
+            base_rot = random_rotation(rng)
+            out = np.empty_like(actions)
+            _global_actions(base_rot, actions, out)
+            np.testing.assert_allclose(
+                out, reference_global_actions(base_rot, actions), atol=1e-8
+            )
+
+
+class TestWriteObsDataset(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.f = h5py.File(os.path.join(self.tmp_dir.name, "demo.hdf5"), "w")
+        self.grp = self.f.create_group("data/demo_0")
+        rng = np.random.default_rng(0)
+        # quantized values so that every compressor actually shrinks the data
+        self.point_cloud = np.round(rng.normal(size=(37, 128, 6)), 2).astype(
+            np.float32
+        )
+        self.depth = np.round(rng.uniform(size=(5, 16, 16, 1)), 3).astype(np.float16)
+
+    def tearDown(self):
+        self.f.close()
+        self.tmp_dir.cleanup()
+
+    def check_round_trip(self, name, arr, obs_kwargs, executor=None):
+        ds = _write_obs_dataset(self.grp, name, arr, obs_kwargs, executor=executor)
+        self.assertEqual(ds.dtype, arr.dtype)
+        np.testing.assert_array_equal(self.grp[name][()], arr)
+        return ds
+
+    def test_gzip_parallel_deflate(self):
+        """
+        37 timesteps leave a partial edge chunk, which must be padded for the direct write.
+        """
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            obs_kwargs = get_compression_kwargs(compression_args("gzip"))
+            ds = self.check_round_trip(
+                "obs/point_cloud", self.point_cloud, obs_kwargs, executor
+            )
+            self.assertEqual(ds.compression, "gzip")
+            self.assertEqual(ds.chunks, (16, 128, 6))
+            self.check_round_trip("obs/depth", self.depth, obs_kwargs, executor)
+
+    def test_blosc(self):
+        for compressor in ["blosc_zstd", "blosc_lz4"]:
+            obs_kwargs = get_compression_kwargs(compression_args(compressor))
+            ds = self.check_round_trip(
+                "obs/{}/point_cloud".format(compressor), self.point_cloud, obs_kwargs
+            )
+            self.assertIsNotNone(ds.chunks)
+            self.assertLess(ds.id.get_storage_size(), self.point_cloud.nbytes)
+
+    def test_empty(self):
+        obs_kwargs = get_compression_kwargs(compression_args("gzip"))
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            self.check_round_trip(
+                "obs/point_cloud", self.point_cloud[:0], obs_kwargs, executor
+            )
+        self.check_round_trip("obs/eef_pos", np.zeros((0, 3)), obs_kwargs)
+
+    def test_low_dim_contiguous(self):
+        obs_kwargs = get_compression_kwargs(compression_args("gzip"))
+        eef_pos = np.arange(37 * 3, dtype=np.float64).reshape(37, 3)
+        ds = self.check_round_trip("obs/robot0/eef_pos", eef_pos, obs_kwargs)
+        self.assertIsNone(ds.chunks)
+        self.assertIsNone(ds.compression)
+
+    def test_source_dtype(self):
+        ds = _write_obs_dataset(
+            self.grp, "obs/depth", self.depth, dict(), source_dtype="float32"
+        )
+        self.assertEqual(ds.attrs["source_dtype"], "float32")
+        self.assertIsNone(ds.chunks)
+        np.testing.assert_array_equal(ds[()], self.depth)
+
+
+class TestWriteVideoObs(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.f = h5py.File(os.path.join(self.tmp_dir.name, "demo.hdf5"), "w")
+        self.grp = self.f.create_group("data/demo_0")
+
+    def tearDown(self):
+        self.f.close()
+        self.tmp_dir.cleanup()
+
+    def test_decoded_shape(self):
+        """
+        84 is not a multiple of ffmpeg's default macro block size of 16, so frames must not
+        get resized on the way.
+        """
+        frames = np.zeros((6, 84, 84, 3), dtype=np.uint8)
+        frames[:, 20:60, 30:50] = 255
+        video_path = os.path.join(
+            self.tmp_dir.name, "demo_videos", "demo_0", "agentview_image.mp4"
+        )
+        ds = _write_video_obs(
+            self.grp, "obs/agentview_image", frames, video_path, self.tmp_dir.name
+        )
+        decoded = get_image_obs(ds)
+        self.assertEqual(decoded.shape, frames.shape)
+        self.assertLess(
+            np.abs(decoded.astype(np.int32) - frames.astype(np.int32)).mean(), 8
+        )
+
+    def test_odd_size(self):
+        frames = np.zeros((2, 85, 84, 3), dtype=np.uint8)
+        with self.assertRaises(ValueError):
+            _write_video_obs(
+                self.grp,
+                "obs/agentview_image",
+                frames,
+                os.path.join(self.tmp_dir.name, "agentview_image.mp4"),
+                self.tmp_dir.name,
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
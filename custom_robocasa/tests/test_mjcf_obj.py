@@ -0,0 +1,42 @@
+import os
+import unittest
+
+import robosuite
+import robosuite_model_zoo
+
+from robocasa.utils.model_zoo.mjcf_obj import postprocess_model_xml
+
+MODEL_XML = """<mujoco model="obj">
+  <asset>
+    <mesh name="visual" file="/old/robosuite/models/assets/objects/meshes/visual.obj"/>
+    <mesh name="zoo" file="/old/robosuite-model-zoo-dev/assets/zoo.obj"/>
+    <texture name="tex" file="textures/tex.png"/>
+  </asset>
+  <worldbody/>
+</mujoco>"""
+
+
+class TestPostprocessModelXml(unittest.TestCase):
+    def test_rewrites_paths(self):
+        xml = postprocess_model_xml(MODEL_XML)
+        robosuite_path = os.path.split(robosuite.__file__)[0]
+        rmz_path = os.path.dirname(os.path.split(robosuite_model_zoo.__file__)[0])
+        self.assertIn(
+            'file="{}/models/assets/objects/meshes/visual.obj"'.format(robosuite_path),
+            xml,
+        )
+        self.assertIn('file="{}/assets/zoo.obj"'.format(rmz_path), xml)
+        self.assertIn('file="textures/tex.png"', xml)
+
+    def test_declared_input(self):
+        """
+        The output starts with an xml declaration including the encoding, and must be accepted
+        as input again.
+        """
+        xml = postprocess_model_xml(MODEL_XML)
+        self.assertTrue(xml.startswith("<?xml"))
+        self.assertEqual(postprocess_model_xml(xml), xml)
+
+
+if __name__ == "__main__":
+    unittest.main()
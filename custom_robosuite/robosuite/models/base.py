@@ -26,12 +26,18 @@ class MujocoXML(object):
 
     Args:
         fname (str): path to the MJCF xml file.
+
+        root (None or ET.Element): if specified, used as the root of the MJCF xml instead of parsing @fname. @fname
+            is then only used to resolve relative asset paths. The tree is used and modified in place.
     """
 
-    def __init__(self, fname):
+    def __init__(self, fname, root=None):
         self.file = fname
         self.folder = os.path.dirname(fname)
-        self.tree = ET.parse(fname)
+        if root is None:
+            self.tree = ET.parse(fname)
+        else:
+            self.tree = ET.ElementTree(root)
         self.root = self.tree.getroot()
         self.worldbody = self.create_default_element("worldbody")
         self.actuator = self.create_default_element("actuator")
@@ -325,10 +325,15 @@ class MujocoXMLObject(MujocoObject, MujocoXML):
             visual geom copy
 
         scale (float or list of floats): 3D scale factor
+
+        root (None or ET.Element): if specified, used as the root of the object's xml instead of parsing @fname.
+            @fname is then only used to resolve relative asset paths
     """
 
-    def __init__(self, fname, name, joints="default", obj_type="all", duplicate_collision_geoms=True, scale=None):
-        MujocoXML.__init__(self, fname)
+    def __init__(
+        self, fname, name, joints="default", obj_type="all", duplicate_collision_geoms=True, scale=None, root=None
+    ):
+        MujocoXML.__init__(self, fname, root=root)
         # Set obj type and duplicate args
         assert obj_type in GEOM_GROUPS, "object type must be one in {}, got: {} instead.".format(GEOM_GROUPS, obj_type)
         self.obj_type = obj_type